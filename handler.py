@@ -4,25 +4,25 @@
 Send Wordfeud rating data to CDF
 """
 
-import calendar
+import bisect
+import functools
+import itertools
+import json
+import logging
+import operator
+import re
+import threading
 import time
-import argparse
+from concurrent.futures import ThreadPoolExecutor
 # Removed cryptography import - no longer needed for credential storage
-from cognite.client import CogniteClient, ClientConfig
-from cognite.client.credentials import OAuthClientCredentials
-from cognite.client.data_classes import ExtractionPipeline
-from cognite.client.data_classes import ExtractionPipelineRun
-from cognite.client.data_classes import TimeSeries
-from cognite.client.exceptions import CogniteDuplicatedError
-from datetime import datetime
 import sys
 import os
 
 # Add the parent directory to the path so we can import from src
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-# Import Wordfeud API from local files (included in zip)
-from wordfeud_api import Wordfeud
+# The Cognite SDK and the Wordfeud API are imported inside the functions that use them,
+# so that a cold start only pays for the imports its code path needs.
 
 # Import credentials (for local development only)
 try:
@@ -32,53 +32,285 @@ except ImportError:
     EMAIL = PASSWORD = USERNAME = None
     LOCAL_CREDENTIALS_AVAILABLE = False
 
+# Function secrets holding the Wordfeud credentials, with their local development fallbacks
+# (all None when credentials.py is not available)
+_SECRET_FALLBACKS = {'wordfeud-email': EMAIL, 'wordfeud-pass': PASSWORD, 'wordfeud-user': USERNAME}
+
+# Optional: faster JSON serialization of CDF request payloads
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 GLOBAL_CLIENT = None
 
+# Per-game and per-series details are logged at DEBUG level, so they cost nothing unless
+# the log level asks for them
+logger = logging.getLogger(__name__)
+
+def _configure_logging(level):
+    """Send log records to stdout as plain messages, at the given level name, or INFO if invalid"""
+    if not logging.getLogger().handlers:
+        logging.basicConfig(format='%(message)s', stream=sys.stdout)
+    # getLevelName returns the number for a known level name and a string otherwise
+    level_number = logging.getLevelName(str(level).upper())
+    if isinstance(level_number, int):
+        logger.setLevel(level_number)
+    else:
+        logger.setLevel(logging.INFO)
+        logger.warning("Unknown log level %r, logging at INFO", level)
+
+_HOUR_MS = 3600000
+_WEEK_MS = 7*24*_HOUR_MS
+
+def now_ms():
+    """Current time in whole milliseconds since the epoch, using integer math only"""
+    return time.time_ns() // 1_000_000
+
+# Board types and rule sets accepted by the extractor, named after the Wordfeud client constants
+BOARD_TYPES = ('BoardNormal', 'BoardRandom')
+RULE_SETS = ('RuleSetAmerican', 'RuleSetDanish', 'RuleSetDutch', 'RuleSetEnglish',
+             'RuleSetFrench', 'RuleSetNorwegian', 'RuleSetSpanish', 'RuleSetSwedish')
+
+# Azure AD tenants are identified by a GUID or by one of their domain names
+_TENANT_ID_RE = re.compile(
+    r'[0-9a-fA-F]{8}(-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}'
+    r'|([A-Za-z0-9]([A-Za-z0-9-]*[A-Za-z0-9])?\.)+[A-Za-z]{2,}')
+
+# Metrics stored as time series, in the order they are created and inserted, with the
+# name and unit of their time series
+_METRIC_INFO = {
+    'rating': ('Wordfeud Rating', 'rating'),
+    'games_played': ('Wordfeud Games Played', 'count'),
+    'games_won': ('Wordfeud Games Won', 'count'),
+    'win_rate': ('Wordfeud Win Rate', 'percentage'),
+    'current_streak': ('Wordfeud Current Streak', 'count'),
+    'best_rating': ('Wordfeud Best Rating', 'rating'),
+}
+_METRICS = tuple(_METRIC_INFO)
+
+@functools.lru_cache(maxsize=32)
+def _eids(username):
+    """Map each metric to its time series external ID for the given username"""
+    return {metric: f'WORDFEUD/{username}/{metric}' for metric in _METRICS}
+
+# Stale-while-revalidate cache for Wordfeud API calls, keyed by (username, endpoint, *args).
+# Values are (value, fresh_until, stale_until). Lives at module level so it survives
+# warm invocations of the CDF function container.
+_CACHE = {}
+# Keys with a background refresh in flight, so a stale entry is only refreshed once at a time
+_REFRESHING = set()
+_REFRESHING_LOCK = threading.Lock()
+
+def cached(ttl_fresh=180, ttl_stale=420):
+    """Cache a Wordfeud API call with stale-while-revalidate semantics.
+
+    The decorated function must take (wordfeud_client, username, *args). Fresh hits are
+    returned directly, stale hits are returned while a background thread refreshes the
+    entry, and misses are fetched synchronously. Keyword arguments are passed through
+    but are not part of the cache key. The wrapper's fetch() always calls the API and
+    stores the result, for callers that can't use a cached value.
+    """
+    def decorator(func):
+        def fetch(wordfeud_client, username, *args, **kwargs):
+            value = func(wordfeud_client, username, *args, **kwargs)
+            fetched = time.monotonic()
+            _CACHE[(username, func.__name__) + args] = (value, fetched + ttl_fresh, fetched + ttl_stale)
+            return value
+
+        def refresh(key, wordfeud_client, username, *args, **kwargs):
+            try:
+                fetch(wordfeud_client, username, *args, **kwargs)
+            except Exception as e:
+                logger.warning("Background refresh of %s for %s failed: %s", func.__name__, username, e)
+            finally:
+                with _REFRESHING_LOCK:
+                    _REFRESHING.discard(key)
+
+        @functools.wraps(func)
+        def wrapper(wordfeud_client, username, *args, **kwargs):
+            key = (username, func.__name__) + args
+            entry = _CACHE.get(key)
+            if entry:
+                value, fresh_until, stale_until = entry
+                now = time.monotonic()
+                if now < fresh_until:
+                    return value
+                if now < stale_until:
+                    with _REFRESHING_LOCK:
+                        start_refresh = key not in _REFRESHING
+                        _REFRESHING.add(key)
+                    if start_refresh:
+                        threading.Thread(target=refresh, args=(key, wordfeud_client, username) + args,
+                                         kwargs=kwargs, daemon=True).start()
+                    return value
+            return fetch(wordfeud_client, username, *args, **kwargs)
+        wrapper.fetch = fetch
+        return wrapper
+    return decorator
+
+def _get_ratings(wordfeud_client, username, rule_set, board_type):
+    """Get finished games with rating information for a board type and rule set"""
+    return wordfeud_client.get_ratings(ruleset=rule_set, board_type=board_type)
+
+@cached()
+def _get_game_history(wordfeud_client, username):
+    """Get (finished_ms, won) for each finished game of the logged in user, oldest first.
+
+    Only the finish time and result of each game are needed for the game totals, so the full
+    game objects are reduced right after the fetch instead of being kept in the cache. Games
+    still in progress, whose 'updated' timestamp is their latest move, and games without a
+    valid 'updated' timestamp are left out.
+    """
+    history = []
+    for game in wordfeud_client.get_games() or ():
+        game_updated = game.get('updated')
+        if game_updated and int(game_updated) > 0 and not game.get('is_running', False):
+            history.append((int(game_updated) * 1000, 1 if game.get('result') == 'won' else 0))
+    history.sort()
+    return tuple(history)
+
+# OAuth access tokens are persisted here between CLI runs, keyed by client id, token URL,
+# scopes and audience
+_TOKEN_CACHE_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'wordfeud-cdf', 'token.json')
+_TOKEN_EXPIRY_LEEWAY_SECONDS = 60
+
+def _read_token_cache():
+    """Read the persisted OAuth tokens, or an empty dict if there are none"""
+    try:
+        with open(_TOKEN_CACHE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_token_cache(tokens):
+    """Persist OAuth tokens, readable by the current user only"""
+    try:
+        os.makedirs(os.path.dirname(_TOKEN_CACHE_PATH), exist_ok=True)
+        fd = os.open(_TOKEN_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(tokens, f)
+    except OSError as e:
+        logger.warning("Could not persist OAuth token to %s: %s", _TOKEN_CACHE_PATH, e)
+
+def _cached_oauth_credentials(**kwargs):
+    """Create OAuth client credentials that reuse a persisted access token until it expires"""
+    from cognite.client.credentials import OAuthClientCredentials
+
+    # A token is only valid for the scopes and audience it was issued for, so two CDF clusters
+    # using the same app registration need separate entries
+    cache_key = f"{kwargs['client_id']}@{kwargs['token_url']} {' '.join(kwargs['scopes'])} {kwargs.get('audience')}"
+
+    class CachedOAuthClientCredentials(OAuthClientCredentials):
+        def _refresh_access_token(self):
+            tokens = _read_token_cache()
+            cached_token = tokens.get(cache_key)
+            if cached_token and cached_token['expires_at'] - time.time() > _TOKEN_EXPIRY_LEEWAY_SECONDS:
+                return cached_token['access_token'], cached_token['expires_at']
+
+            access_token, expires_at = super()._refresh_access_token()
+            tokens[cache_key] = {'access_token': access_token, 'expires_at': expires_at}
+            _write_token_cache(tokens)
+            return access_token, expires_at
+
+    return CachedOAuthClientCredentials(**kwargs)
+
+@functools.lru_cache(maxsize=4)
+def get_cognite_client(project, base_url, client_id, client_secret, token_url):
+    """Get a CogniteClient for the given configuration, reusing one built earlier in this process"""
+    from cognite.client import CogniteClient, ClientConfig
+
+    creds = _cached_oauth_credentials(
+        token_url=token_url,
+        client_id=client_id,
+        client_secret=client_secret,
+        scopes=[f"{base_url}/.default"],
+        audience=base_url)
+    config = ClientConfig(
+        client_name='wordfeud-rating-reader',
+        project=project,
+        base_url=base_url,
+        credentials=creds)
+    return CogniteClient(config)
+
+def get_board_setting(wordfeud_client, name, allowed):
+    """Look up a board type or rule set constant on the Wordfeud client, if it is whitelisted"""
+    if name not in allowed:
+        raise ValueError(f"Unsupported Wordfeud board setting '{name}'. Expected one of: {', '.join(allowed)}")
+    return getattr(wordfeud_client, name)
+
+# Logged-in Wordfeud clients, keyed by (email, board_type, rule_set). Lives at module level so
+# warm invocations of the CDF function container skip the login round trip.
+_WF_CLIENTS = {}
+
+def get_wordfeud_client(email, password, board_type, rule_set):
+    """Get a logged-in Wordfeud client configured with the given board type and rule set.
+
+    Returns (wordfeud_client, reused), where reused tells whether the client and its session
+    came from an earlier invocation.
+    """
+    # Import Wordfeud API from local files (included in zip)
+    from wordfeud_api import Wordfeud
+
+    key = (email, board_type, rule_set)
+    wordfeud_client = _WF_CLIENTS.get(key)
+    if wordfeud_client is not None:
+        return wordfeud_client, True
+
+    wordfeud_client = Wordfeud()
+    wordfeud_client.board_type = get_board_setting(wordfeud_client, board_type, BOARD_TYPES)
+    wordfeud_client.rule_set = get_board_setting(wordfeud_client, rule_set, RULE_SETS)
+    wordfeud_client.login_email(email, password)
+    _WF_CLIENTS[key] = wordfeud_client
+    return wordfeud_client, False
+
 def create_time_series(client, dataset_id, username):
     """Create time series for Wordfeud data"""
+    from cognite.client.data_classes import TimeSeries
+    from cognite.client.exceptions import CogniteDuplicatedError
+
+    eids = _eids(username)
     time_series = [
-        TimeSeries(name=f'Wordfeud Rating - {username}', external_id=f'WORDFEUD/{username}/rating', unit='rating', is_step=True),
-        TimeSeries(name=f'Wordfeud Games Played - {username}', external_id=f'WORDFEUD/{username}/games_played', unit='count', is_step=True),
-        TimeSeries(name=f'Wordfeud Games Won - {username}', external_id=f'WORDFEUD/{username}/games_won', unit='count', is_step=True),
-        TimeSeries(name=f'Wordfeud Win Rate - {username}', external_id=f'WORDFEUD/{username}/win_rate', unit='percentage', is_step=True),
-        TimeSeries(name=f'Wordfeud Current Streak - {username}', external_id=f'WORDFEUD/{username}/current_streak', unit='count', is_step=True),
-        TimeSeries(name=f'Wordfeud Best Rating - {username}', external_id=f'WORDFEUD/{username}/best_rating', unit='rating', is_step=True)
+        TimeSeries(name=f'{name} - {username}', external_id=eids[metric], unit=unit, is_step=True)
+        for metric, (name, unit) in _METRIC_INFO.items()
     ]
     
-    for ts in time_series:
-        if dataset_id != -1:
+    if dataset_id != -1:
+        for ts in time_series:
             ts.data_set_id = dataset_id
-        try:
-            client.time_series.create(ts)
-        except CogniteDuplicatedError as err:
-            print(f'{ts.external_id} already exists')
-
-def delete_existing_timeseries(client, username):
-    """Delete existing time series for the given username"""
-    external_ids = [
-        f'WORDFEUD/{username}/rating',
-        f'WORDFEUD/{username}/games_played',
-        f'WORDFEUD/{username}/games_won',
-        f'WORDFEUD/{username}/win_rate',
-        f'WORDFEUD/{username}/current_streak',
-        f'WORDFEUD/{username}/best_rating'
-    ]
+    try:
+        client.time_series.create(time_series)
+    except CogniteDuplicatedError as err:
+        # Create only the time series that did not already exist
+        duplicated = {item.get('externalId') for item in err.duplicated}
+        for external_id in sorted(duplicated):
+            logger.info('%s already exists', external_id)
+        missing = [ts for ts in time_series if ts.external_id not in duplicated]
+        if missing:
+            client.time_series.create(missing)
+
+def delete_existing_timeseries(client, username, confirm=True):
+    """Delete existing time series for the given username.
+
+    With confirm=True the user is asked before anything is deleted. Without a terminal to
+    ask on, the deletion is refused rather than blocking on input.
+    """
+    external_ids = list(_eids(username).values())
     
-    existing_timeseries = []
-    for external_id in external_ids:
-        try:
-            ts = client.time_series.retrieve(external_id=external_id)
-            existing_timeseries.append(ts)
-        except Exception:
-            # Time series doesn't exist, skip
-            pass
+    # Time series that don't exist are left out of the result
+    existing_timeseries = client.time_series.retrieve_multiple(external_ids=external_ids, ignore_unknown_ids=True)
     
     if existing_timeseries:
         print(f"Found {len(existing_timeseries)} existing time series for user '{username}':")
         for ts in existing_timeseries:
             print(f"  - {ts.name} ({ts.external_id})")
         
-        response = input(f"\n❓ Do you want to delete these time series? (yes/no): ")
+        if confirm and not sys.stdin.isatty():
+            print("❌ Cannot ask for confirmation without a terminal. Use --yes to delete without confirmation")
+            return False
+        response = input(f"\n❓ Do you want to delete these time series? (yes/no): ") if confirm else 'yes'
         if response.lower() == 'yes':
             try:
                 client.time_series.delete(external_id=[ts.external_id for ts in existing_timeseries])
@@ -96,6 +328,9 @@ def delete_existing_timeseries(client, username):
 
 def create_extraction_pipeline(client, extraction_pipeline, dataset_id, username):
     """Create extraction pipeline for Wordfeud data"""
+    from cognite.client.data_classes import ExtractionPipeline
+    from cognite.client.exceptions import CogniteDuplicatedError
+
     extpipe = ExtractionPipeline(
         name=f"Wordfeud Extractor - {username}",
         external_id=extraction_pipeline, 
@@ -106,536 +341,385 @@ def create_extraction_pipeline(client, extraction_pipeline, dataset_id, username
     try:
         client.extraction_pipelines.create(extpipe)
     except CogniteDuplicatedError as err:
-        print('Extraction pipeline %s already exists' % extraction_pipeline)
+        logger.info('Extraction pipeline %s already exists', extraction_pipeline)
 
 def report_extraction_pipeline_run(client, extraction_pipeline, status='success', message=None):
     """Report extraction pipeline run status"""
+    from cognite.client.data_classes import ExtractionPipelineRun
+
     extpiperun = ExtractionPipelineRun(status=status, extpipe_external_id=extraction_pipeline)
     if message:
         extpiperun.message = message
     client.extraction_pipelines.runs.create(extpiperun)
 
-def get_latest_datapoint(client, external_id):
-    """Get the latest datapoint from a time series"""
+_PLACEHOLDER_EXTRACTION_PIPELINE = 'extractors/wordfeud-USERNAME'
+
+def get_extraction_pipeline_to_report(data, username):
+    """Get the extraction pipeline to report runs to, or None if reporting should be skipped"""
+    if not data.get('report-pipeline', True):
+        return None
+    extraction_pipeline = data.get('extraction-pipeline')
+    if not extraction_pipeline and username:
+        # Auto-generate extraction pipeline name from username
+        extraction_pipeline = f'extractors/wordfeud-{username}'
+    if extraction_pipeline == _PLACEHOLDER_EXTRACTION_PIPELINE:
+        # Unfilled placeholder from a local dev setup
+        return None
+    return extraction_pipeline
+
+def get_latest_datapoints(client, external_ids):
+    """Get the latest datapoint of each time series in a single request.
+
+    Returns a dict keyed by external ID. Time series that are empty, do not exist, or
+    could not be retrieved map to None.
+    """
+    latest = dict.fromkeys(external_ids)
     try:
-        # Get the latest datapoint
-        datapoints = client.time_series.data.retrieve_latest(
-            external_id=external_id
+        datapoints_list = client.time_series.data.retrieve_latest(
+            external_id=list(external_ids), ignore_unknown_ids=True
         )
-        if datapoints and len(datapoints) > 0:
-            return datapoints[0]
-        return None
+        for datapoints in datapoints_list:
+            if len(datapoints) > 0:
+                latest[datapoints.external_id] = datapoints[0]
     except Exception as e:
-        print(f"Could not retrieve latest datapoint for {external_id}: {e}")
-        return None
+        logger.warning("Could not retrieve latest datapoints for %s: %s", ', '.join(external_ids), e)
+    return latest
+
+def _game_opponent_and_result(game):
+    """Get the opponent's username and the result ('won', 'lost' or 'tied') of a game.
 
-def get_wordfeud_data(wordfeud_client, client, username, start_time, end_time, board_type=None, rule_set=None):
-    """Fetch Wordfeud data and only create datapoints for completed games"""
-    datapoints = {
-        'rating': [],
-        'games_played': [],
-        'games_won': [],
-        'win_rate': [],
-        'current_streak': [],
-        'best_rating': []
-    }
+    Either is 'unknown' when the players array doesn't tell.
+    """
+    players = game.get('players', [])
+    local_player = next((player for player in players if player.get('is_local', False)), None)
+    opponent_player = next((player for player in players if not player.get('is_local', False)), None)
+    opponent = opponent_player.get('username', 'unknown') if opponent_player else 'unknown'
     
-    try:
-        # Get games with rating information (finished games) - filtered by board type and rule set
-        games_with_ratings = wordfeud_client.get_ratings(ruleset=rule_set, board_type=board_type)
-        if not games_with_ratings:
-            print(f"No games with rating information available for board_type={board_type}, rule_set={rule_set}")
-            return datapoints
+    result = 'unknown'
+    if local_player and opponent_player:
+        local_score = local_player.get('score', 0)
+        opponent_score = opponent_player.get('score', 0)
+        # The comparison is 1, -1 or 0, which picks 'won', 'lost' or 'tied'
+        result = ('tied', 'won', 'lost')[(local_score > opponent_score) - (local_score < opponent_score)]
+    return opponent, result
+
+def get_wordfeud_data(wordfeud_client, client, username, start_time, end_time, board_type=None, rule_set=None, relogin=None):
+    """Fetch Wordfeud data and only create datapoints for completed games
+
+    relogin, if given, is called to get a freshly logged-in client when a Wordfeud request
+    fails, and the request is retried once with it. The CDF requests are never retried.
+    """
+    datapoints = {metric: [] for metric in _METRICS}
+    
+    def call_wordfeud(fetch, *args):
+        nonlocal wordfeud_client, relogin
+        try:
+            return fetch(wordfeud_client, *args)
+        except Exception:
+            if relogin is None:
+                raise
+            logger.warning("Wordfeud request with reused session failed, logging in again", exc_info=True)
+            wordfeud_client, relogin = relogin(), None
+            return fetch(wordfeud_client, *args)
+    
+    eids = _eids(username)
+    rating_external_id = eids['rating']
+    best_rating_external_id = eids['best_rating']
+    
+    # The Wordfeud and CDF lookups are independent network calls, so run them concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # Get the game history to calculate the totals as of each game
+        history_future = executor.submit(call_wordfeud, _get_game_history, username)
+        # Get the latest stored rating to determine the last processed timestamp, and the
+        # latest best rating to use as baseline for best rating tracking
+        latest_future = executor.submit(get_latest_datapoints, client, (rating_external_id, best_rating_external_id))
+    
+    history = history_future.result()
+    latest = latest_future.result()
+    latest_rating_datapoint = latest[rating_external_id]
+    latest_best_rating_datapoint = latest[best_rating_external_id]
+    
+    # Most scheduled runs find nothing new. If no game has finished since the last stored
+    # rating there is nothing to add, so the ratings don't need to be fetched at all.
+    if latest_rating_datapoint and history and history[-1][0] <= latest_rating_datapoint.timestamp:
+        logger.info("No games finished since the latest datapoint in time series %s, nothing to do", rating_external_id)
+        return datapoints
+    
+    # Get games with rating information (finished games) - filtered by board type and rule set.
+    # Not cached: the game that got this run past the check above may be missing from a cached list.
+    games_with_ratings = call_wordfeud(_get_ratings, username, rule_set, board_type)
+    if not games_with_ratings:
+        logger.info("No games with rating information available for board_type=%s, rule_set=%s", board_type, rule_set)
+        return datapoints
+    
+    logger.info("Found %d games with ratings for board_type=%s, rule_set=%s", len(games_with_ratings), board_type, rule_set)
+    
+    if latest_rating_datapoint:
+        # We have existing data - find new games since the last datapoint
+        last_timestamp = latest_rating_datapoint.timestamp
+        last_datapoint_date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(last_timestamp // 1000))
+        logger.info("Found latest datapoint in time series %s: timestamp=%s (%s), value=%s",
+                    rating_external_id, last_timestamp, last_datapoint_date, latest_rating_datapoint.value)
+    else:
+        # First run - every completed game gets initial datapoints
+        last_timestamp = 0
+        logger.info("No existing datapoints found in time series %s", rating_external_id)
+    
+    # Set baseline for best rating tracking (even in first run)
+    if latest_best_rating_datapoint:
+        current_best_rating = latest_best_rating_datapoint.value
+        best_rating_date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(latest_best_rating_datapoint.timestamp // 1000))
+        logger.debug("Found latest best rating datapoint: timestamp=%s (%s), value=%s",
+                     latest_best_rating_datapoint.timestamp, best_rating_date, current_best_rating)
+    else:
+        current_best_rating = 0
+        logger.debug("No existing best rating datapoints found, starting baseline at 0")
+    
+    # Find games that were completed after the last datapoint, as (finish time, game)
+    # pairs so the 'updated' timestamp is parsed only once per game. The API does not
+    # guarantee any order, so every game is checked once and only the new ones are sorted.
+    new_rating_games = []
+    for game in games_with_ratings:
+        game_updated = game.get('updated')
+        if game_updated and game.get('rating') is not None:
+            game_finished_time = int(game_updated) * 1000  # Convert to milliseconds
+            if game_finished_time <= 0:
+                logger.warning("Game %s has invalid updated timestamp: %s, skipping this game", game.get('id'), game_updated)
+            elif game_finished_time > last_timestamp:
+                new_rating_games.append((game_finished_time, game))
+    
+    if not new_rating_games:
+        if latest_rating_datapoint:
+            logger.info("No new completed games found")
+        else:
+            logger.info("First run: No completed games found - no initial datapoints created")
+        return datapoints
+    
+    # Sort games by finish time to process them chronologically
+    new_rating_games.sort(key=operator.itemgetter(0))
+    
+    # The cached game history can be older than the ratings, and a new rated game missing from
+    # it would get totals that leave it out. Once written that is never reprocessed, so fetch
+    # the history again now that the ratings are in and every rated game is in it.
+    history = call_wordfeud(_get_game_history.fetch, username)
+    
+    # Games played and won as of a timestamp are found by bisecting the finish times
+    # and reading the running total of wins
+    history_times = [finished for finished, _ in history]
+    cumulative_wins = list(itertools.accumulate(won for _, won in history))
+    
+    if latest_rating_datapoint:
+        logger.info("Found %d new completed games", len(new_rating_games))
+    else:
+        logger.info("First run: Found %d completed games to create initial datapoints", len(new_rating_games))
+    logger.debug("Processing games for time series: %s", rating_external_id)
+    logger.debug("Best rating baseline: %s", current_best_rating)
+    
+    # Create datapoint for each completed game (regardless of rating change)
+    # The game details are only worked out when they are going to be logged
+    log_games = logger.isEnabledFor(logging.DEBUG)
+    for game_finished_time, game in new_rating_games:
+        game_rating = game.get('rating')
         
-        print(f"Found {len(games_with_ratings)} games with ratings for board_type={board_type}, rule_set={rule_set}")
+        if log_games:
+            opponent, result = _game_opponent_and_result(game)
+            game_end_date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(game_finished_time // 1000))
+            logger.debug("Game %s against %s (%s): Rating %s (change: %s) finished at %s",
+                         game.get('id', 'unknown'), opponent, result, game_rating, game.get('rating_delta', 0), game_end_date)
         
-        # Get the latest stored rating to determine the last processed timestamp
-        rating_external_id = f'WORDFEUD/{username}/rating'
-        latest_rating_datapoint = get_latest_datapoint(client, rating_external_id)
+        # Store rating datapoint
+        datapoints['rating'].append((game_finished_time, game_rating))
         
-        # Get the latest best rating to use as baseline for best rating tracking
-        best_rating_external_id = f'WORDFEUD/{username}/best_rating'
-        latest_best_rating_datapoint = get_latest_datapoint(client, best_rating_external_id)
+        # Update best rating if this game improved it
+        if game_rating > current_best_rating:
+            current_best_rating = game_rating
+            datapoints['best_rating'].append((game_finished_time, game_rating))
         
-        if latest_rating_datapoint:
-            # We have existing data - find new games since the last datapoint
-            last_timestamp = latest_rating_datapoint.timestamp
-            last_datapoint_date = datetime.utcfromtimestamp(last_timestamp/1000).strftime("%Y-%m-%d %H:%M:%S")
-            print(f"Found latest datapoint in time series {rating_external_id}: timestamp={last_timestamp} ({last_datapoint_date}), value={latest_rating_datapoint.value}")
-            
-            # Set baseline for best rating tracking
-            if latest_best_rating_datapoint:
-                current_best_rating = latest_best_rating_datapoint.value
-                best_rating_date = datetime.utcfromtimestamp(latest_best_rating_datapoint.timestamp/1000).strftime("%Y-%m-%d %H:%M:%S")
-                print(f"Found latest best rating datapoint: timestamp={latest_best_rating_datapoint.timestamp} ({best_rating_date}), value={current_best_rating}")
-            else:
-                current_best_rating = 0
-                print(f"No existing best rating datapoints found, starting baseline at 0")
-            
-            # Find games that were completed after the last datapoint
-            new_rating_games = []
-            for game in games_with_ratings:
-                if game.get('rating') is not None and game.get('updated'):
-                    game_updated = game.get('updated')
-                    if game_updated and int(game_updated) > 0:
-                        game_finished_time = int(game_updated) * 1000  # Convert to milliseconds
-                        if game_finished_time > last_timestamp:
-                            new_rating_games.append(game)
-            
-            if new_rating_games:
-                # Sort games by finish time to process them chronologically
-                new_rating_games.sort(key=lambda g: int(g['updated']))
-                
-                print(f"Found {len(new_rating_games)} new completed games")
-                print(f"Processing games for time series: WORDFEUD/{username}/rating")
-                print(f"Best rating baseline: {current_best_rating}")
-                
-                # Create datapoint for each completed game (regardless of rating change)
-                for game in new_rating_games:
-                    # Use the 'updated' timestamp as the game finish time
-                    game_updated = game.get('updated')
-                    if not game_updated or int(game_updated) <= 0:
-                        print(f"WARNING: Game {game.get('id')} has invalid updated timestamp: {game_updated}, skipping this game")
-                        continue
-                    
-                    # Convert seconds to milliseconds
-                    game_finished_time = int(game_updated) * 1000
-                    game_rating = game.get('rating')
-                    rating_delta = game.get('rating_delta', 0)
-                    
-                    game_end_date = datetime.utcfromtimestamp(game_finished_time/1000).strftime("%Y-%m-%d %H:%M:%S")
-                    print(f"Game {game.get('id')}: Rating {game_rating} (change: {rating_delta}) finished at {game_end_date}")
-                    
-                    # Extract available metadata from the API response
-                    game_metadata = {
-                        'game_id': game.get('id', 'unknown'),
-                        'rating_delta': rating_delta,
-                        'ruleset': game.get('ruleset'),
-                        'board': game.get('board'),
-                        'move_count': game.get('move_count'),
-                        'created': game.get('created'),
-                        'updated': game.get('updated')
-                    }
-                    
-                    # Extract opponent information from players array
-                    players = game.get('players', [])
-                    if players:
-                        # Find the opponent (non-local player)
-                        for player in players:
-                            if not player.get('is_local', False):
-                                game_metadata['opponent'] = player.get('username', 'unknown')
-                                game_metadata['opponent_score'] = player.get('score', 0)
-                                break
-                    
-                    # Determine game result based on scores
-                    local_player = None
-                    opponent_player = None
-                    for player in players:
-                        if player.get('is_local', False):
-                            local_player = player
-                        else:
-                            opponent_player = player
-                    
-                    if local_player and opponent_player:
-                        local_score = local_player.get('score', 0)
-                        opponent_score = opponent_player.get('score', 0)
-                        if local_score > opponent_score:
-                            game_metadata['result'] = 'won'
-                        elif local_score < opponent_score:
-                            game_metadata['result'] = 'lost'
-                        else:
-                            game_metadata['result'] = 'tied'
-                    
-                    # Store rating datapoint with available metadata
-                    datapoints['rating'].append({
-                        'timestamp': game_finished_time,
-                        'value': game_rating,
-                        'metadata': game_metadata
-                    })
-                    
-                    # Update best rating if this game improved it
-                    if game_rating > current_best_rating:
-                        current_best_rating = game_rating
-                        datapoints['best_rating'].append({
-                            'timestamp': game_finished_time,
-                            'value': game_rating,
-                            'metadata': {
-                                'game_id': game.get('id', 'unknown'),
-                                'result': game_metadata.get('result', 'unknown'),
-                                'rating_delta': rating_delta
-                            }
-                        })
-                    
-                    # Update other metrics based on the state after this game
-                    # Get all games to calculate current totals
-                    all_games = wordfeud_client.get_games()
-                    if all_games:
-                        total_games = len(all_games)
-                        won_games = sum(1 for g in all_games if g.get('result') == 'won')
-                        win_rate = (won_games / total_games * 100) if total_games > 0 else 0
-                        
-                        datapoints['games_played'].append({
-                            'timestamp': game_finished_time,
-                            'value': total_games,
-                            'metadata': {
-                                'game_id': game.get('id', 'unknown'),
-                                'result': game_metadata.get('result', 'unknown'),
-                                'rating_delta': rating_delta
-                            }
-                        })
-                        
-                        datapoints['games_won'].append({
-                            'timestamp': game_finished_time,
-                            'value': won_games,
-                            'metadata': {
-                                'game_id': game.get('id', 'unknown'),
-                                'result': game_metadata.get('result', 'unknown'),
-                                'rating_delta': rating_delta
-                            }
-                        })
-                        
-                        datapoints['win_rate'].append({
-                            'timestamp': game_finished_time,
-                            'value': win_rate,
-                            'metadata': {
-                                'game_id': game.get('id', 'unknown'),
-                                'result': game_metadata.get('result', 'unknown'),
-                                'rating_delta': rating_delta
-                            }
-                        })
-            else:
-                print("No new completed games found")
-        else:
-            print(f"No existing datapoints found in time series {rating_external_id}")
+        # Update other metrics based on the totals as of this game
+        total_games = bisect.bisect_right(history_times, game_finished_time)
+        if total_games:
+            won_games = cumulative_wins[total_games - 1]
+            win_rate = won_games / total_games * 100
             
-            # Set baseline for best rating tracking (even in first run)
-            if latest_best_rating_datapoint:
-                current_best_rating = latest_best_rating_datapoint.value
-                best_rating_date = datetime.utcfromtimestamp(latest_best_rating_datapoint.timestamp/1000).strftime("%Y-%m-%d %H:%M:%S")
-                print(f"Found existing best rating datapoint: timestamp={latest_best_rating_datapoint.timestamp} ({best_rating_date}), value={current_best_rating}")
-            else:
-                current_best_rating = 0
-                print(f"No existing best rating datapoints found, starting baseline at 0")
+            datapoints['games_played'].append((game_finished_time, total_games))
             
-            # First run - check if there are any completed games to create initial datapoints
-            completed_games = []
-            for game in games_with_ratings:
-                if game.get('rating') is not None and game.get('updated'):
-                    completed_games.append(game)
+            datapoints['games_won'].append((game_finished_time, won_games))
             
-            if completed_games:
-                # Sort games by finish time to process them chronologically
-                completed_games.sort(key=lambda g: int(g['updated']))
-                
-                print(f"First run: Found {len(completed_games)} completed games to create initial datapoints")
-                print(f"Best rating baseline: {current_best_rating}")
-                
-                # Create datapoint for each completed game
-                for game in completed_games:
-                    # Use the 'updated' timestamp as the game finish time
-                    game_updated = game.get('updated')
-                    if not game_updated or int(game_updated) <= 0:
-                        print(f"WARNING: Game {game.get('id')} has invalid updated timestamp: {game_updated}, skipping this game")
-                        continue
-                    
-                    # Convert seconds to milliseconds
-                    game_finished_time = int(game_updated) * 1000
-                    game_rating = game.get('rating')
-                    rating_delta = game.get('rating_delta', 0)
-                    
-                    game_end_date = datetime.utcfromtimestamp(game_finished_time/1000).strftime("%Y-%m-%d %H:%M:%S")
-                    print(f"Game {game.get('id')}: Rating {game_rating} (change: {rating_delta}) finished at {game_end_date}")
-                    
-                    # Extract available metadata from the API response
-                    game_metadata = {
-                        'game_id': game.get('id', 'unknown'),
-                        'rating_delta': rating_delta,
-                        'ruleset': game.get('ruleset'),
-                        'board': game.get('board'),
-                        'move_count': game.get('move_count'),
-                        'created': game.get('created'),
-                        'updated': game.get('updated')
-                    }
-                    
-                    # Extract opponent information from players array
-                    players = game.get('players', [])
-                    if players:
-                        # Find the opponent (non-local player)
-                        for player in players:
-                            if not player.get('is_local', False):
-                                game_metadata['opponent'] = player.get('username', 'unknown')
-                                game_metadata['opponent_score'] = player.get('score', 0)
-                                break
-                    
-                    # Determine game result based on scores
-                    local_player = None
-                    opponent_player = None
-                    for player in players:
-                        if player.get('is_local', False):
-                            local_player = player
-                        else:
-                            opponent_player = player
-                    
-                    if local_player and opponent_player:
-                        local_score = local_player.get('score', 0)
-                        opponent_score = opponent_player.get('score', 0)
-                        if local_score > opponent_score:
-                            game_metadata['result'] = 'won'
-                        elif local_score < opponent_score:
-                            game_metadata['result'] = 'lost'
-                        else:
-                            game_metadata['result'] = 'tied'
-                    
-                    # Store rating datapoint with available metadata
-                    datapoints['rating'].append({
-                        'timestamp': game_finished_time,
-                        'value': game_rating,
-                        'metadata': game_metadata
-                    })
-                    
-                    # Update best rating if this game improved it
-                    if game_rating > current_best_rating:
-                        current_best_rating = game_rating
-                        datapoints['best_rating'].append({
-                            'timestamp': game_finished_time,
-                            'value': game_rating,
-                            'metadata': {
-                                'game_id': game.get('id', 'unknown'),
-                                'result': game_metadata.get('result', 'unknown'),
-                                'rating_delta': rating_delta
-                            }
-                        })
-                    
-                    # Update other metrics based on the state after this game
-                    # Get all games to calculate current totals
-                    all_games = wordfeud_client.get_games()
-                    if all_games:
-                        total_games = len(all_games)
-                        won_games = sum(1 for g in all_games if g.get('result') == 'won')
-                        win_rate = (won_games / total_games * 100) if total_games > 0 else 0
-                        
-                        datapoints['games_played'].append({
-                            'timestamp': game_finished_time,
-                            'value': total_games,
-                            'metadata': {
-                                'game_id': game.get('id', 'unknown'),
-                                'result': game_metadata.get('result', 'unknown'),
-                                'rating_delta': rating_delta
-                            }
-                        })
-                        
-                        datapoints['games_won'].append({
-                            'timestamp': game_finished_time,
-                            'value': won_games,
-                            'metadata': {
-                                'game_id': game.get('id', 'unknown'),
-                                'result': game_metadata.get('result', 'unknown'),
-                                'rating_delta': rating_delta
-                            }
-                        })
-                        
-                        datapoints['win_rate'].append({
-                            'timestamp': game_finished_time,
-                            'value': win_rate,
-                            'metadata': {
-                                'game_id': game.get('id', 'unknown'),
-                                'result': game_metadata.get('result', 'unknown'),
-                                'rating_delta': rating_delta
-                            }
-                        })
-            else:
-                print("First run: No completed games found - no initial datapoints created")
-        
-        total_datapoints = sum(len(d) for d in datapoints.values())
-        print(f"Successfully processed Wordfeud data: {total_datapoints} new datapoints")
-        if total_datapoints > 0:
-            for metric, points in datapoints.items():
-                if points:
-                    external_id = f'WORDFEUD/{username}/{metric}'
-                    print(f"  - {external_id}: {len(points)} datapoints")
-        
-    except Exception as e:
-        print(f"Error processing Wordfeud data: {e}")
-        import traceback
-        traceback.print_exc()
+            datapoints['win_rate'].append((game_finished_time, win_rate))
+    
+    total_datapoints = sum(len(d) for d in datapoints.values())
+    logger.info("Successfully processed Wordfeud data: %d new datapoints", total_datapoints)
+    if total_datapoints > 0:
+        for metric, points in datapoints.items():
+            if points:
+                external_id = eids[metric]
+                logger.debug("  - %s: %d datapoints", external_id, len(points))
     
     return datapoints
 
+def _use_orjson_for_cdf_payloads():
+    """Serialize CDF request payloads with orjson, if it is installed"""
+    if orjson is None:
+        return
+    # The SDK serializes request bodies through cognite.client.utils._json.dumps, which is
+    # replaced for the whole process, so anything orjson can't do exactly goes to the SDK encoder
+    from cognite.client.utils import _json
+    if getattr(_json.dumps, 'uses_orjson', False):
+        return
+    sdk_dumps = _json.dumps
+
+    def dumps(obj, **kwargs):
+        # orjson can neither indent nor sort keys, as used for the SDK's printable output
+        if (kwargs.get('indent') is not None or kwargs.get('sort_keys')
+                or set(kwargs) - {'indent', 'sort_keys', 'allow_nan'}):
+            return sdk_dumps(obj, **kwargs)
+        try:
+            encoded = orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+        except TypeError:
+            return sdk_dumps(obj, **kwargs)
+        # orjson writes NaN and infinity as null. With allow_nan=False the SDK encoder has to
+        # tell those apart from real nulls, and reject them.
+        if not kwargs.get('allow_nan', True) and b'null' in encoded:
+            return sdk_dumps(obj, **kwargs)
+        return encoded.decode()
+    dumps.uses_orjson = True
+    _json.dumps = dumps
+
 def store_wordfeud_data(client, data, username):
-    """Store Wordfeud data in CDF with metadata"""
-    ts_point_list = []
-    
-    for metric, datapoints in data.items():
-        if datapoints:
-            external_id = f'WORDFEUD/{username}/{metric}'
-            
-            # Convert datapoints to CDF format
-            cdf_datapoints = []
-            for dp in datapoints:
-                if isinstance(dp, dict):
-                    # New format with metadata
-                    cdf_datapoint = {
-                        'timestamp': dp['timestamp'],
-                        'value': dp['value']
-                    }
-                    if 'metadata' in dp:
-                        cdf_datapoint['metadata'] = dp['metadata']
-                    cdf_datapoints.append(cdf_datapoint)
-                else:
-                    # Legacy format (timestamp, value)
-                    cdf_datapoints.append({'timestamp': dp[0], 'value': dp[1]})
-            
-            if cdf_datapoints:
-                # Check if time series exists before inserting
-                try:
-                    ts_info = client.time_series.retrieve(external_id=external_id)
-                    print(f"✓ Time series {external_id} exists")
-                except Exception as ts_error:
-                    print(f"❌ Time series {external_id} does not exist: {ts_error}")
-                    print(f"  Skipping data insertion for {external_id}")
-                    continue
-                
-                ts_point_list.append({
-                    'externalId': external_id, 
-                    'datapoints': cdf_datapoints
-                })
+    """Store Wordfeud data in CDF.
+
+    The time series are created by --init, so they are not looked up first. Any that turn
+    out to be missing are skipped and the insert is retried with the rest.
+    """
+    from cognite.client.exceptions import CogniteNotFoundError
+
+    eids = _eids(username)
+    # Datapoints are (timestamp, value) tuples, which insert_multiple accepts as they are
+    ts_point_list = [
+        {'externalId': eids[metric], 'datapoints': data[metric]}
+        for metric in _METRICS if data.get(metric)
+    ]
     
     if ts_point_list:
         try:
-            print(f"Attempting to insert {len(ts_point_list)} time series to CDF...")
+            logger.info("Inserting %d time series to CDF", len(ts_point_list))
             for ts_data in ts_point_list:
-                external_id = ts_data['externalId']
-                datapoint_count = len(ts_data['datapoints'])
-                print(f"  - {external_id}: {datapoint_count} datapoints")
                 # Log first datapoint for debugging
-                if ts_data['datapoints']:
-                    first_dp = ts_data['datapoints'][0]
-                    print(f"    First datapoint: timestamp={first_dp['timestamp']}, value={first_dp['value']}")
+                first_timestamp, first_value = ts_data['datapoints'][0]
+                logger.debug("  - %s: %d datapoints, first datapoint: timestamp=%s, value=%s",
+                             ts_data['externalId'], len(ts_data['datapoints']), first_timestamp, first_value)
             
             # Insert the data
-            print(f"Data structure being sent to CDF:")
-            for ts_data in ts_point_list:
-                external_id = ts_data['externalId']
-                datapoints = ts_data['datapoints']
-                print(f"  {external_id}: {len(datapoints)} datapoints")
-                if datapoints:
-                    first_dp = datapoints[0]
-                    print(f"    Sample datapoint: {first_dp}")
-            
-            result = client.time_series.data.insert_multiple(ts_point_list)
-            print(f"✓ CDF insert_multiple completed successfully")
+            _use_orjson_for_cdf_payloads()
+            # The SDK splits large payloads into requests within the API limits itself
+            try:
+                client.time_series.data.insert_multiple(ts_point_list)
+            except CogniteNotFoundError as err:
+                # Inserting datapoints is idempotent, so series that already went through
+                # are simply written again
+                missing = {item.get('externalId') for item in err.not_found}
+                for external_id in sorted(missing):
+                    logger.warning("Time series %s does not exist, skipping data insertion", external_id)
+                ts_point_list = [ts_data for ts_data in ts_point_list if ts_data['externalId'] not in missing]
+                if ts_point_list:
+                    client.time_series.data.insert_multiple(ts_point_list)
+            logger.debug("CDF insert_multiple completed successfully")
             
-            # Verify the insertion by checking if time series has data
-            for ts_data in ts_point_list:
-                external_id = ts_data['externalId']
-                try:
-                    # Get the latest datapoint to verify insertion
-                    latest = client.time_series.data.retrieve_latest(external_id=external_id)
-                    if latest and len(latest) > 0:
-                        print(f"✓ Verified: {external_id} has data (latest: {latest[0].timestamp})")
+            # insert_multiple raises if the insert fails, so reading the data back is only
+            # worth an extra request when debugging
+            if logger.isEnabledFor(logging.DEBUG):
+                latest = get_latest_datapoints(client, [ts_data['externalId'] for ts_data in ts_point_list])
+                for external_id, latest_datapoint in latest.items():
+                    if latest_datapoint:
+                        logger.debug("Verified: %s has data (latest: %s)", external_id, latest_datapoint.timestamp)
                     else:
-                        print(f"⚠️  Warning: {external_id} appears to be empty after insertion")
-                except Exception as verify_error:
-                    print(f"⚠️  Warning: Could not verify {external_id}: {verify_error}")
+                        logger.warning("%s appears to be empty after insertion", external_id)
                     
         except Exception as insert_error:
-            print(f"❌ Error inserting data to CDF: {insert_error}")
-            print(f"Error type: {type(insert_error).__name__}")
+            logger.error("Error inserting data to CDF: %s: %s", type(insert_error).__name__, insert_error)
             # Log the data that failed to insert
             for ts_data in ts_point_list:
                 external_id = ts_data['externalId']
                 datapoint_count = len(ts_data['datapoints'])
-                print(f"  Failed to insert: {external_id} ({datapoint_count} datapoints)")
+                logger.error("  Failed to insert: %s (%d datapoints)", external_id, datapoint_count)
             raise
 
 def handle(data, client, secrets):
     """Main handler function for the CDF function"""
     global GLOBAL_CLIENT
     GLOBAL_CLIENT = client
+    _configure_logging(data.get('log-level', 'INFO'))
     
     try:
         # Get credentials from function secrets (production) or credentials file (local development)
-        email = secrets.get('wordfeud-email')
-        password = secrets.get('wordfeud-pass')
-        username = secrets.get('wordfeud-user')
-        
-        # Fall back to local credentials file for local development
-        if not email and LOCAL_CREDENTIALS_AVAILABLE:
-            email = EMAIL
-        if not password and LOCAL_CREDENTIALS_AVAILABLE:
-            password = PASSWORD
-        if not username and LOCAL_CREDENTIALS_AVAILABLE:
-            username = USERNAME
+        email, password, username = (secrets.get(key) or fallback for key, fallback in _SECRET_FALLBACKS.items())
         
         if not email or not password or not username:
             raise Exception("Wordfeud credentials not found. Please configure function secrets (wordfeud-email, wordfeud-pass, wordfeud-user) or ensure credentials.py exists for local development.")
         
-        # Initialize Wordfeud client with board configuration
-        wordfeud_client = Wordfeud()
-        wordfeud_client.login_email(email, password)
-        
         # Configure board type and rule set
         board_type = data.get('board_type', secrets.get('board-type', 'BoardNormal'))
         rule_set = data.get('rule_set', secrets.get('rule-set', 'RuleSetNorwegian'))
         
-        # Set board configuration
-        wordfeud_client.board_type = getattr(wordfeud_client, board_type)
-        wordfeud_client.rule_set = getattr(wordfeud_client, rule_set)
+        # Initialize Wordfeud client with board configuration
+        wordfeud_client, reused_session = get_wordfeud_client(email, password, board_type, rule_set)
         
-        print(f"✓ Wordfeud login successful")
-        print(f"✓ Board configured: {board_type}, {rule_set}")
+        logger.info("Wordfeud %s", 'session reused' if reused_session else 'login successful')
+        logger.info("Board configured: %s, %s", board_type, rule_set)
         
         # Determine time range
-        start_time = (int(time.time()*1000) - 7*24*3600000) - ((int(time.time()*1000) - 7*24*3600000) % (3600000))
+        end_time = now_ms()
+        week_ago = end_time - _WEEK_MS
+        start_time = week_ago - (week_ago % _HOUR_MS)
         if 'start-time' in data:
             start_time = int(data['start-time'])
 
-        end_time = int(time.time()*1000)
         if 'end-time' in data:
             end_time = int(data['end-time'])
 
-        start_date = datetime.utcfromtimestamp(start_time/1000).strftime("%Y-%m-%d")
-        end_date = datetime.utcfromtimestamp(end_time/1000).strftime("%Y-%m-%d")
-        print(f'Starting Wordfeud data extraction from {start_date} to {end_date}')
+        start_date = time.strftime("%Y-%m-%d", time.gmtime(start_time // 1000))
+        end_date = time.strftime("%Y-%m-%d", time.gmtime(end_time // 1000))
+        logger.info('Starting Wordfeud data extraction from %s to %s', start_date, end_date)
 
+        # The session from an earlier invocation may have expired, so a failing Wordfeud
+        # request with a reused session is retried once after logging in again
+        def relogin():
+            _WF_CLIENTS.pop((email, board_type, rule_set), None)
+            return get_wordfeud_client(email, password, board_type, rule_set)[0]
+        
         # Get and store data
         wordfeud_data = get_wordfeud_data(wordfeud_client, client, username, start_time, end_time, 
-                                        board_type=wordfeud_client.board_type, rule_set=wordfeud_client.rule_set)
+                                          board_type=wordfeud_client.board_type, rule_set=wordfeud_client.rule_set,
+                                          relogin=relogin if reused_session else None)
         
         if any(wordfeud_data.values()):
             store_wordfeud_data(client, wordfeud_data, username)
-            print(f'Successfully processed Wordfeud data for {username}')
+            logger.info('Successfully processed Wordfeud data for %s', username)
         else:
-            print('No Wordfeud data was collected for the specified time range')
+            logger.info('No Wordfeud data was collected for the specified time range')
 
         # Report extraction pipeline run
-        extraction_pipeline = data.get('extraction-pipeline')
-        if not extraction_pipeline and username:
-            # Auto-generate extraction pipeline name from username
-            extraction_pipeline = f'extractors/wordfeud-{username}'
-        
+        extraction_pipeline = get_extraction_pipeline_to_report(data, username)
         if extraction_pipeline:
             report_extraction_pipeline_run(client, extraction_pipeline)
             
     except Exception as e:
         error_msg = f'Critical error in handle function: {type(e).__name__}: {str(e)}'
-        print(error_msg)
+        logger.error(error_msg)
         
         # Report failure to extraction pipeline if configured
-        extraction_pipeline = data.get('extraction-pipeline')
-        if not extraction_pipeline and username:
-            # Auto-generate extraction pipeline name from username
-            extraction_pipeline = f'extractors/wordfeud-{username}'
-        
+        extraction_pipeline = get_extraction_pipeline_to_report(data, username)
         if extraction_pipeline:
             try:
                 report_extraction_pipeline_run(client, extraction_pipeline, status='failure', message=error_msg)
             except Exception as pipeline_error:
-                print(f'Failed to report pipeline failure: {pipeline_error}')
+                logger.error('Failed to report pipeline failure: %s', pipeline_error)
         
         raise
 
 if __name__ == "__main__":
+    import argparse
+
     parser = argparse.ArgumentParser()
 
     parser.add_argument( 
@@ -658,60 +742,57 @@ if __name__ == "__main__":
         '-i', '--init', type=bool, help='Create necessary time series and extraction pipeline, but do not do anything else.', default=False)
     parser.add_argument(
         '--cleanup', action='store_true', help='Delete existing time series before creating new ones (requires --init)')
+    parser.add_argument(
+        '-y', '--yes', action='store_true', help='Do not ask for confirmation before deleting time series with --cleanup')
     parser.add_argument(
         '-d', '--dataset', type=int, help='Dataset ID from Cognite Data Fusion', default=-1)
     parser.add_argument(
         '-a', '--admin_security_category', type=int, help='ID of admin security category for the Wordfeud credentials', default=-1)
     parser.add_argument(
         '--extraction_pipeline', type=str, help='External ID of extraction pipeline to update on every run', default=None)
+    parser.add_argument(
+        '--no-pipeline-report', action='store_true', help='Do not report the run to the extraction pipeline (useful for local testing)')
+    parser.add_argument(
+        '-v', '--verbose', action='store_true', help='Log details for every game and time series')
     # Credentials are now loaded from credentials.py file
     parser.add_argument(
-        '--board_type', type=str, choices=['BoardNormal', 'BoardRandom'], default='BoardNormal',
+        '--board_type', type=str, choices=BOARD_TYPES, default='BoardNormal',
         help='Wordfeud board type. Default: BoardNormal')
     parser.add_argument(
-        '--rule_set', type=str, 
-        choices=['RuleSetAmerican', 'RuleSetDanish', 'RuleSetDutch', 'RuleSetEnglish', 
-                'RuleSetFrench', 'RuleSetNorwegian', 'RuleSetSpanish', 'RuleSetSwedish'],
+        '--rule_set', type=str, choices=RULE_SETS,
         default='RuleSetNorwegian', help='Wordfeud rule set/language. Default: RuleSetNorwegian')
 
     args = parser.parse_args()
+    _configure_logging('DEBUG' if args.verbose else 'INFO')
+    current_ms = now_ms()
     if args.start_time == -1:
-        args.start_time = (int(time.time()*1000) - 7*24*3600000) - ((int(time.time()*1000) - 7*24*3600000) % (3600000))
+        week_ago = current_ms - _WEEK_MS
+        args.start_time = week_ago - (week_ago % _HOUR_MS)
     if args.end_time == -1:
-        args.end_time = int(time.time()*1000)
+        args.end_time = current_ms
 
-    SCOPES = ["%s/.default" % args.base_url]
     if args.token_url:
         TOKEN_URL = args.token_url
     elif args.tenant_id:
-        # Azure AD configuration
-        TOKEN_URL = "https://login.microsoftonline.com/%s/oauth2/v2.0/token" % args.tenant_id
+        # Azure AD configuration. Catch a mistyped tenant here rather than as a failed token request
+        if not _TENANT_ID_RE.fullmatch(args.tenant_id):
+            raise ValueError(f"Invalid --tenant_id {args.tenant_id!r}: expected a tenant GUID or domain name")
+        TOKEN_URL = f"https://login.microsoftonline.com/{args.tenant_id}/oauth2/v2.0/token"
     else:
         # Other IDP configuration - token URL must be provided explicitly
         raise ValueError("Either --token_url or --tenant_id must be provided for IDP configuration")
 
-    creds = OAuthClientCredentials(
-        token_url=TOKEN_URL,
-        client_id=args.client_id,
-        client_secret=args.key,
-        scopes=SCOPES,
-        audience=args.base_url)
-    config = ClientConfig(
-        client_name='wordfeud-rating-reader',
-        project=args.project,
-        base_url=args.base_url,
-        credentials=creds)
-    client = CogniteClient(config)
+    # For initialization, use credentials from file or command line. This is checked before
+    # the CDF client is built, so a missing USERNAME fails without touching CDF.
+    init_username = USERNAME if LOCAL_CREDENTIALS_AVAILABLE else None
+    if args.init and not init_username:
+        print("❌ Error: USERNAME not found in credentials.py")
+        print("Please add USERNAME to your credentials.py file for local initialization")
+        sys.exit(1)
+
+    client = get_cognite_client(args.project, args.base_url, args.client_id, args.key, TOKEN_URL)
 
     if args.init:
-        # For initialization, use credentials from file or command line
-        init_username = USERNAME if LOCAL_CREDENTIALS_AVAILABLE else None
-        
-        if not init_username:
-            print("❌ Error: USERNAME not found in credentials.py")
-            print("Please add USERNAME to your credentials.py file for local initialization")
-            sys.exit(1)
-        
         # Set default extraction pipeline external ID if not provided
         if args.extraction_pipeline is None:
             args.extraction_pipeline = f'extractors/wordfeud-{init_username}'
@@ -719,7 +800,7 @@ if __name__ == "__main__":
         # Handle cleanup if requested
         if args.cleanup:
             print(f"🧹 Cleanup mode: Checking for existing time series for user '{init_username}'...")
-            if not delete_existing_timeseries(client, init_username):
+            if not delete_existing_timeseries(client, init_username, confirm=not args.yes):
                 print("❌ Cleanup failed or was cancelled. Exiting.")
                 sys.exit(1)
             print("✅ Cleanup completed successfully")
@@ -737,11 +818,12 @@ if __name__ == "__main__":
         
         # Set default extraction pipeline external ID if not provided
         if args.extraction_pipeline is None:
-            init_username = USERNAME if LOCAL_CREDENTIALS_AVAILABLE else None
             if init_username:
                 args.extraction_pipeline = f'extractors/wordfeud-{init_username}'
         
         data['extraction-pipeline'] = args.extraction_pipeline
+        data['report-pipeline'] = not args.no_pipeline_report
+        data['log-level'] = 'DEBUG' if args.verbose else 'INFO'
         data['board_type'] = args.board_type
         data['rule_set'] = args.rule_set
         handle(data, client, secrets) 
\ No newline at end of file